@@ -0,0 +1,246 @@
+"""
+Distributed load generation
+
+A coordinator sends the merged configuration to a number of agents, starts
+them together once every agent is ready, and merges the per-interval counters
+they stream back into a single Stats timeline.
+
+Messages are dictionaries sent as JSON over authenticated multiprocessing
+connections, rather than pickled, so that a peer can't run code by sending one:
+    agent -> coordinator: hello, ready, interval, done
+    coordinator -> agent: run, start, stop, exit
+"""
+import ipaddress
+import json
+import logging
+from multiprocessing import Process
+from multiprocessing.connection import Client, Listener
+import os
+import socket
+import threading
+
+from .plan import compile_plan
+from .stats import STATS_DUMP_DELAY, Stats
+from .testcase import Testcase
+
+
+AGENT_DONE_TIMEOUT = 60
+
+AUTHKEY_VARIABLE = "PYBENCH_AUTHKEY"
+
+
+def parse_address(address):
+    """split host:port, the host defaults to the loopback address"""
+    host, _, port = address.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+
+def is_loopback(host):
+    """True if host only accepts local connections"""
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def send(connection, message):
+    """send a message"""
+    connection.send_bytes(json.dumps(message).encode())
+
+
+def receive(connection):
+    """receive a message"""
+    return json.loads(connection.recv_bytes().decode())
+
+
+class Coordinator(object):
+    """Coordinator"""
+
+    def __init__(self, address, authkey, agent_count):
+        self.address = address
+        self.authkey = authkey
+        self.agent_count = agent_count
+        self.listener = None
+        self.agents = []
+        self.processes = []
+        self.lock = threading.Lock()
+        self.running = 0
+
+    def accept(self, spawn=0):
+        """wait for agent_count agents, spawning `spawn' of them locally"""
+        self.listener = Listener(self.address, authkey=self.authkey)
+        logging.info("Coordinator listening on %s:%s for %d agent(s).",
+                     self.listener.address[0], self.listener.address[1], self.agent_count)
+
+        host, port = self.listener.address
+        if host == "0.0.0.0":
+            host = "127.0.0.1"
+        for _ in range(spawn):
+            process = Process(target=run_agent, args=((host, port), self.authkey))
+            process.start()
+            self.processes.append(process)
+
+        while len(self.agents) < self.agent_count:
+            connection = self.listener.accept()
+            hello = receive(connection)
+            assert hello["type"] == "hello"
+            logging.info("Agent %d connected from %s (pid %s).",
+                         len(self.agents), hello["host"], hello["pid"])
+            self.agents.append(connection)
+
+    def run(self, plan, testcase, uri, stats):
+        """run a testcase on the agents, merging their results into stats"""
+        testcase.run(uri, stats, sections=("startup", ))
+
+        for agent_id, connection in enumerate(self.agents):
+            send(connection, {
+                "type": "run",
+                "config": plan.config,
+                "uri": uri,
+                "agent-id": agent_id,
+                "agent-count": len(self.agents),
+            })
+        for connection in self.agents:
+            message = receive(connection)
+            assert message["type"] == "ready"
+
+        # Agent intervals arrive after the agent has closed them
+        stats.dump_delay = 2 * STATS_DUMP_DELAY + 1
+        self.running = len(self.agents)
+        stats.start()
+        for connection in self.agents:
+            send(connection, {"type": "start"})
+
+        receivers = []
+        for agent_id, connection in enumerate(self.agents):
+            thread = threading.Thread(
+                target=self._receive, args=(agent_id, connection, stats, ))
+            thread.start()
+            receivers.append(thread)
+
+        stats.done.wait()
+        for agent_id, connection in enumerate(self.agents):
+            try:
+                send(connection, {"type": "stop"})
+            except OSError:
+                logging.info("Couldn't stop agent %d, it has been lost.", agent_id)
+        for thread in receivers:
+            thread.join(AGENT_DONE_TIMEOUT)
+            if thread.is_alive():
+                logging.info("An agent hasn't finished, its last results may be missing.")
+        stats.flush()
+
+        testcase.run(uri, stats, sections=("cleanup", ))
+
+    def _receive(self, agent_id, connection, stats):
+        """merge interval counters from an agent until it is done or lost"""
+        try:
+            while True:
+                message = receive(connection)
+                if message["type"] == "done":
+                    break
+                for instance, counters in message["counters"].items():
+                    stats.log(
+                        instance, counters, current_time=stats.start_time + message["elapsed"])
+        except (EOFError, OSError):
+            logging.error("Lost agent %d, its remaining results are missing.", agent_id)
+
+        with self.lock:
+            self.running -= 1
+            if self.running == 0:
+                stats.set_done()
+
+    def close(self):
+        """tell the agents to exit"""
+        for connection in self.agents:
+            try:
+                send(connection, {"type": "exit"})
+            except OSError:
+                pass
+            connection.close()
+        for process in self.processes:
+            process.join(AGENT_DONE_TIMEOUT)
+            if process.is_alive():
+                logging.info("A spawned agent hasn't exited, terminating it.")
+                process.terminate()
+        if self.listener:
+            self.listener.close()
+
+
+class Agent(object):
+    """Agent"""
+
+    def __init__(self, address, authkey):
+        self.connection = Client(address, authkey=authkey)
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        """send a message, connections aren't thread safe"""
+        with self.lock:
+            send(self.connection, message)
+
+    def serve(self):
+        """run testcases for the coordinator until told to exit"""
+        self.send({"type": "hello", "host": socket.gethostname(), "pid": os.getpid()})
+        while True:
+            message = receive(self.connection)
+            if message["type"] == "exit":
+                break
+            assert message["type"] == "run"
+            self.run(message)
+        self.connection.close()
+
+    def run(self, message):
+        """run the testing section of a testcase"""
+        plan = compile_plan(message["config"])
+        agent_id = message["agent-id"]
+        agent_count = message["agent-count"]
+        testcase = Testcase(plan.testcase, agent_id, agent_count)
+
+        # Split max-iterations exactly between the agents
+        max_iterations, remainder = divmod(plan.testcase.max_iterations, agent_count)
+        if agent_id < remainder:
+            max_iterations += 1
+        stats = Stats(
+            max_iterations,
+            plan.testcase.max_time_seconds,
+            operations=testcase.get_operation_names(),
+            schedule=testcase.schedule)
+        # Results are shown by the coordinator
+        stats.output = open(os.devnull, "w")
+
+        def publish(time_index, counters):
+            """send an interval, timed relative to the start of the run"""
+            start = max(time_index * stats.interval, stats.start_time)
+            end = (time_index + 1) * stats.interval
+            self.send({
+                "type": "interval",
+                "elapsed": (start + end) / 2 - stats.start_time,
+                "counters": counters,
+            })
+        stats.on_interval = publish
+
+        self.send({"type": "ready"})
+        start = receive(self.connection)
+        assert start["type"] == "start"
+
+        listener = threading.Thread(target=self._wait_for_stop, args=(stats, ))
+        listener.start()
+
+        try:
+            testcase.run(message["uri"], stats, sections=("testing", ))
+        finally:
+            # Even if testing failed, so that the coordinator isn't left waiting
+            stats.output.close()
+            self.send({"type": "done"})
+            listener.join()
+
+    def _wait_for_stop(self, stats):
+        message = receive(self.connection)
+        assert message["type"] == "stop"
+        stats.set_done()
+
+
+def run_agent(address, authkey):
+    """run an agent until the coordinator tells it to exit"""
+    Agent(address, authkey).serve()
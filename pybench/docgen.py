@@ -0,0 +1,200 @@
+"""
+Document generators
+
+Document templates are compiled once into plain callables so that building a
+document does not re-interpret the template for every iteration.
+
+A template value is one of:
+  - a scalar (str, int, float, bool, null), used as-is
+  - a list, compiled into an array whose elements are compiled templates
+  - a dictionary with a single key naming a generator, e.g. {"random-int": [0, 10]}
+  - any other dictionary, compiled into a nested sub-document
+
+A single-key sub-document whose key looks like a generator name (contains a
+hyphen) is rejected as a likely typo; wrap it in {"object": ...} to insert it.
+"""
+from datetime import datetime, timedelta
+import itertools
+import random
+import struct
+import time
+import uuid
+
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from pytz import utc
+
+
+class DocGenerator(object):
+    """Compiles document templates into document builders
+
+    worker_id and worker_count identify the calling worker among all workers so
+    that sequences and ids can be made unique across processes without locking.
+    """
+    # pylint: disable=no-self-use
+
+    def __init__(self, text, random_bytes, compressible, worker_id=0, worker_count=1):
+        self.text = text
+        self.bytes = random_bytes
+        self.compressible = compressible
+        self.worker_id = worker_id
+        self.worker_count = worker_count
+
+        self.generators = {
+            "random-int": self._random_int,
+            "random-float": self._random_float,
+            "random-normal": self._random_normal,
+            "random-list": self._random_list,
+            "iibench-string": self._iibench_string,
+            "random-text": self._random_text,
+            "random-bytes": self._random_bytes,
+            "date": self._date,
+            "uuid": self._uuid,
+            "uuid-string": self._uuid_string,
+            "sequence": self._sequence,
+            "object-id": self._object_id,
+            "object": self._object,
+            "array": self._array,
+            "literal": self._literal,
+        }
+
+    def compile_doc(self, template):
+        """compile a document template, returns a callable building a new document"""
+        return self._object(template or {})
+
+    def compile_value(self, value):
+        """compile a template value, returns a callable producing the value"""
+        if isinstance(value, dict):
+            if len(value) == 1:
+                key, args = next(iter(value.items()))
+                if key in self.generators:
+                    return self.generators[key](args)
+                if "-" in key:
+                    raise ValueError(
+                        "unknown generator `{}', use {{\"object\": ...}} for a sub-document"
+                        .format(key))
+            return self._object(value)
+        elif isinstance(value, (list, tuple)):
+            return self._list(value)
+        return self._literal(value)
+
+    def _literal(self, value):
+        return lambda: value
+
+    def _object(self, value):
+        items = tuple((key, self.compile_value(item)) for key, item in value.items())
+        return lambda: {key: build() for key, build in items}
+
+    def _list(self, value):
+        builders = tuple(self.compile_value(item) for item in value)
+        return lambda: [build() for build in builders]
+
+    def _array(self, value):
+        """array of `length' elements built from the `of' template"""
+        build = self.compile_value(value["of"])
+        length = self.compile_value(value.get("length", 1))
+        return lambda: [build() for _ in range(int(length()))]
+
+    def _random_int(self, value):
+        low, high = value
+        randint = random.randint
+        return lambda: randint(low, high)
+
+    def _random_float(self, value):
+        rand = random.random
+        return lambda: rand() * value
+
+    def _random_normal(self, value):
+        """normally distributed float, optionally clamped to [min, max]"""
+        mean = value["mean"]
+        stddev = value["stddev"]
+        low = value.get("min", float("-inf"))
+        high = value.get("max", float("inf"))
+        gauss = random.gauss
+        return lambda: min(max(gauss(mean, stddev), low), high)
+
+    def _random_list(self, value):
+        choice = random.choice
+        return lambda: choice(value)
+
+    def _iibench_string(self, value):
+        compress_count = int((value["percent-compressible"] / 100) * value["length"])
+        noncompress_count = value["length"] - compress_count
+        compressible = self.compressible[0:compress_count]
+        text = self.text
+        limit = len(text) - noncompress_count
+        randrange = random.randrange
+
+        def generate():
+            start = randrange(0, limit)
+            return text[start:start + noncompress_count] + compressible
+        return generate
+
+    def _random_text(self, value):
+        length_of = self.compile_value(value)
+        text = self.text
+        randrange = random.randrange
+
+        def generate():
+            length = int(length_of())
+            start = randrange(0, len(text) - length)
+            return text[start:start + length]
+        return generate
+
+    def _random_bytes(self, value):
+        length_of = self.compile_value(value)
+        data = self.bytes
+        randrange = random.randrange
+
+        def generate():
+            length = int(length_of())
+            start = randrange(0, len(data) - length)
+            return Binary(data[start:start + length], 3)
+        return generate
+
+    def _date(self, value):
+        now = datetime.now
+        if isinstance(value, (int, float)):
+            offset = timedelta(seconds=value)
+            return lambda: now(tz=utc) + offset
+        offset_of = self.compile_value(value)
+        return lambda: now(tz=utc) + timedelta(seconds=offset_of())
+
+    def _uuid(self, value):
+        assert value is None
+        return uuid.uuid4
+
+    def _uuid_string(self, value):
+        assert value is None
+        uuid4 = uuid.uuid4
+        return lambda: str(uuid4())
+
+    def _sequence(self, value):
+        """monotonically increasing integers, striped across workers
+
+        value is either the start or {"start", "step"}.
+        """
+        if value is None:
+            value = {}
+        elif isinstance(value, int) and not isinstance(value, bool):
+            value = {"start": value}
+        elif not isinstance(value, dict):
+            raise ValueError("sequence: expected a start or {{\"start\", \"step\"}}, not {!r}"
+                             .format(value))
+        start = value.get("start", 0)
+        step = value.get("step", 1)
+        counter = itertools.count(start + self.worker_id * step, step * self.worker_count)
+        return counter.__next__
+
+    def _object_id(self, value):
+        """ObjectId-like keys: timestamp, per-worker prefix and per-worker counter"""
+        assert value is None
+        prefix = (struct.pack(">H", random.getrandbits(16)) +
+                  struct.pack(">I", self.worker_id & 0xFFFFFF)[1:])
+        counter = itertools.count()
+        pack = struct.Struct(">I").pack
+
+        def generate():
+            return ObjectId(
+                pack(int(time.time())) + prefix + pack(next(counter) & 0xFFFFFF)[1:])
+        return generate
@@ -0,0 +1,62 @@
+"""
+Immutable values
+
+Plans and schedules are compiled once and then shared by every worker, so they
+are built from these read-only types.  All of them can still be pickled.
+"""
+import copyreg
+
+
+class FrozenDict(dict):
+    """Read-only dictionary
+
+    Still a dict, so that plans can be dumped as JSON and given to the driver and
+    the document generators as they are.
+    """
+    __slots__ = ()
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("{} is immutable".format(type(self).__name__))
+
+    __setitem__ = __delitem__ = __ior__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self), ))
+
+
+class Immutable(object):
+    """Object whose attributes, listed in __slots__, are only set by its constructor"""
+    __slots__ = ()
+
+    def __init__(self, **kwargs):
+        self.__setstate__(kwargs)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("{} is immutable".format(type(self).__name__))
+
+    def __reduce__(self):
+        return (copyreg.__newobj__, (type(self), ),
+                {key: getattr(self, key) for key in self.__slots__})
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            object.__setattr__(self, key, value)
+
+
+def freeze(value):
+    """deep read-only copy of a configuration value"""
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """deep mutable copy of a configuration value"""
+    if isinstance(value, dict):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
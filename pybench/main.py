@@ -12,7 +12,9 @@ import time
 import hjson
 
 from pybench import __version__
+from .distributed import AUTHKEY_VARIABLE, Coordinator, is_loopback, parse_address, run_agent
 from .mongod import Mongod
+from .plan import ConfigError, compile_plan
 from .remerge import remerge
 from .stats import Stats
 from .testcase import Testcase
@@ -24,7 +26,12 @@ def load_config(config_files):
     config_list = []
     for config_path in config_files:
         with open(config_path, "r") as cfg:
-            config_list.append(hjson.load(cfg))
+            text = cfg.read()
+        try:
+            # Plain JSON is much faster to parse with the json module
+            config_list.append(json.loads(text))
+        except ValueError:
+            config_list.append(hjson.loads(text))
 
     return remerge(config_list)
 
@@ -43,7 +50,7 @@ def parse_args():
     parser.add_argument(
         "configfiles",
         metavar='CONFIG_FILES',
-        nargs='+',
+        nargs='*',
         help="Configuration file(s).  If multiple files are specified, they are merged"
              " together.  If there is overlap in settings, the last file takes precedence."
         )
@@ -62,7 +69,50 @@ def parse_args():
         "--log-times",
         action="store_true",
         help="timestamp console logs")
-    return parser.parse_args()
+    parser.add_argument(
+        "--coordinator",
+        metavar="HOST:PORT",
+        help="listen on HOST:PORT and generate load from --agents agents")
+    parser.add_argument(
+        "--agents",
+        type=int,
+        default=0,
+        help="number of agents the coordinator waits for")
+    parser.add_argument(
+        "--spawn-agents",
+        type=int,
+        default=0,
+        help="start this many of the agents as local processes")
+    parser.add_argument(
+        "--agent",
+        metavar="HOST:PORT",
+        help="run as an agent of the coordinator at HOST:PORT, no config files are needed")
+    parser.add_argument(
+        "--authkey",
+        default=os.environ.get(AUTHKEY_VARIABLE),
+        help="shared secret between the coordinator and its agents, defaults to ${}; only"
+             " optional when every agent is spawned by a coordinator on a loopback"
+             " address".format(AUTHKEY_VARIABLE))
+    parser.add_argument(
+        "--uri",
+        help="MongoDB URI given to agents, defaults to the local mongod")
+    args = parser.parse_args()
+    if not args.agent and not args.configfiles:
+        parser.error("CONFIG_FILES are required unless running as an --agent")
+    if args.spawn_agents > args.agents:
+        args.agents = args.spawn_agents
+    if args.agents and not args.coordinator:
+        args.coordinator = "127.0.0.1:0"
+    if args.coordinator and args.agents < 1:
+        parser.error("--coordinator needs at least one agent, see --agents")
+    if not args.authkey:
+        if args.agent or args.agents > args.spawn_agents or \
+                (args.coordinator and not is_loopback(parse_address(args.coordinator)[0])):
+            parser.error("--authkey or ${} is required for agents on other hosts".format(
+                AUTHKEY_VARIABLE))
+        # Only agents spawned by this process connect, they are given the key directly
+        args.authkey = os.urandom(32).hex()
+    return args
 
 
 def setup_logging(root, log_level, log_times):
@@ -98,46 +148,70 @@ def main():
     else:
         setup_logging(root, "INFO", args.log_times)
 
-    config = load_config(args.configfiles)
-
-    mongods = []
-    for database_config in config["databases"]:
-        mongods.append(Mongod(database_config, config))
-
-    for mongod in mongods:
-        if mongod.is_enabled():
-            mongod.start()
-
-            try:
-                testcase = Testcase(
-                    config["testcase"],
-                    config)
-
-                stats = Stats(
-                    testcase.config.get("max-iterations"),
-                    testcase.config.get("max-time-seconds"))
-
-                time_string = time.strftime(
-                    "%Y-%m-%d %H:%M",
-                    time.localtime())
-                testcase.run(mongod.get_uri(), stats)
-
-            finally:
-                stats.end()
-
-                results_path = os.path.expanduser(args.results_path)
-                os.makedirs(results_path, exist_ok=True)
-
-                filebase = "{} - {} {}".format(mongod.get_name(), testcase.get_name(), time_string)
-
-                filename = os.path.join(results_path, filebase + ".csv")
-                with open(filename, "w") as output:
-                    stats.save(output)
-
-                filename = os.path.join(results_path, filebase + ".config.json")
-                with open(filename, "w") as output:
-                    json.dump(config, output, indent=4, sort_keys=True)
-                mongod.shutdown()
+    if args.agent:
+        run_agent(parse_address(args.agent), args.authkey.encode())
+        return
+
+    try:
+        plan = compile_plan(load_config(args.configfiles))
+    except ConfigError as error:
+        raise SystemExit("invalid configuration: {}".format(error))
+
+    coordinator = None
+    if args.coordinator:
+        coordinator = Coordinator(
+            parse_address(args.coordinator), args.authkey.encode(), args.agents)
+
+    try:
+        if coordinator:
+            coordinator.accept(spawn=args.spawn_agents)
+
+        mongods = []
+        for database_plan in plan.databases:
+            mongods.append(Mongod(database_plan))
+
+        for mongod in mongods:
+            if mongod.is_enabled():
+                mongod.start()
+
+                try:
+                    testcase = Testcase(plan.testcase)
+
+                    stats = Stats(
+                        plan.testcase.max_iterations,
+                        plan.testcase.max_time_seconds,
+                        operations=testcase.get_operation_names(),
+                        schedule=testcase.schedule)
+
+                    time_string = time.strftime(
+                        "%Y-%m-%d %H:%M",
+                        time.localtime())
+                    if coordinator:
+                        coordinator.run(plan, testcase, args.uri or mongod.get_uri(), stats)
+                    else:
+                        testcase.run(mongod.get_uri(), stats)
+
+                finally:
+                    stats.end()
+
+                    results_path = os.path.expanduser(args.results_path)
+                    os.makedirs(results_path, exist_ok=True)
+
+                    filebase = "{} - {} {}".format(
+                        mongod.get_name(), testcase.get_name(), time_string)
+
+                    filename = os.path.join(results_path, filebase + ".csv")
+                    with open(filename, "w") as output:
+                        stats.save(output)
+
+                    filename = os.path.join(results_path, filebase + ".config.json")
+                    with open(filename, "w") as output:
+                        json.dump(plan.config, output, indent=4, sort_keys=True)
+                    mongod.shutdown()
+    finally:
+        # Spawned agents wait for the coordinator to tell them to exit
+        if coordinator:
+            coordinator.close()
 
 
 if __name__ == "__main__":
@@ -1,73 +1,69 @@
 """
 Mongod
 """
-from copy import deepcopy
 import logging
 import os
 import shutil
 
-from .remerge import remerge
-
 
 class Mongod(object):
     """Mongod class"""
 
-    def __init__(self, database_config, config):
-        self.database_config = deepcopy(database_config)
-        self.defaults = deepcopy(config.get("database-defaults", {}))
-        self.config = remerge([self.defaults, self.database_config])
+    def __init__(self, plan):
+        self.plan = plan
+        self.options = plan.options
 
     def is_enabled(self):
         """is enabled"""
-        return not self.config.get("disabled", False)
+        return self.plan.enabled
 
     def get_name(self):
         """get name"""
-        return self.config["name"]
+        return self.plan.name
 
     def start(self):
         """start"""
-        if self.config.get("clear-paths"):
+        if self.plan.clear_paths:
             logging.debug("Clearing DB paths.")
             for file in ["logpath", "pidfilepath"]:
-                path = self.config["options"].get(file)
+                path = self.options.get(file)
                 if path:
                     try:
                         os.remove(path)
                     except FileNotFoundError:
                         pass
-            if "dbpath" in self.config["options"]:
+            if "dbpath" in self.options:
                 try:
-                    shutil.rmtree(self.config["options"]["dbpath"])
+                    shutil.rmtree(self.options["dbpath"])
                 except FileNotFoundError:
                     pass
 
-        if "dbpath" in self.config["options"]:
-            os.makedirs(self.config["options"]["dbpath"], exist_ok=True)
+        if "dbpath" in self.options:
+            os.makedirs(self.options["dbpath"], exist_ok=True)
 
         cmd = "mongod"
-        for key, value in self.config["options"].items():
+        for key, value in self.options.items():
             cmd += " --{} {}".format(key, value if value is not None else "")
-        if "quiet" in self.config["options"]:
+        if "quiet" in self.options:
             cmd += " > /dev/null"
 
         logging.info("Starting database with command: %s", cmd)
         os.system(cmd)
-        logging.info("Started %s", self.config.get("name"))
+        logging.info("Started %s", self.plan.name)
 
     def shutdown(self):
         """shutdown"""
         cmd = "mongod --shutdown"
-        if "dbpath" in self.config["options"]:
-            cmd += " --dbpath {}".format(self.config["options"]["dbpath"])
-        if "quiet" in self.config["options"]:
+        if "dbpath" in self.options:
+            cmd += " --dbpath {}".format(self.options["dbpath"])
+        if "quiet" in self.options:
             cmd += " --quiet"
             cmd += " > /dev/null"
 
         logging.debug("Shutting down database with command: %s", cmd)
         os.system(cmd)
-        logging.info("Stopped %s", self.config.get("name"))
+        logging.info("Stopped %s", self.plan.name)
 
     def get_uri(self):
         """get uri"""
-        return "mongodb://localhost:{}/".format(self.config["options"].get("port", 27017))
+        return "mongodb://localhost:{}/".format(self.options.get("port", 27017))
@@ -0,0 +1,198 @@
+"""
+Operations
+
+Each operation runs one batch per call to execute() so that a scheduler can
+interleave several operations within a single worker.
+"""
+from datetime import datetime, timedelta
+
+from pytz import utc
+
+
+def insert_template(doc, operation):
+    """document template for an insert or upsert, upserts need an _id"""
+    template = dict(doc or {})
+    if operation == "upsert" and "_id" not in template:
+        template["_id"] = {"uuid": None}
+    return template
+
+
+class Operation(object):
+    """Operation base class
+
+    Periodic operations run every `interval-seconds' in a dedicated worker
+    rather than being picked by the scheduler.  counter is the Stats counter
+    their results are logged under.
+    """
+    # pylint: disable=too-many-instance-attributes
+    periodic = False
+    counter = "ops"
+    batch_size = 1
+
+    def __init__(self, plan, database, generator, throttle):
+        self.name = plan.name
+        self.operation = plan.operation
+        self.database = database
+        self.collection = database[plan.collection] if plan.collection else None
+        self.generator = generator
+        self.throttle = throttle
+        self.count = plan.count
+        self.iterations = 0
+        self.exhausted = False
+
+    def execute(self, limit=None):
+        """run one batch of at most `limit' operations, returns the number performed"""
+        raise NotImplementedError
+
+    def _batch(self, batch_size, limit=None):
+        """size of the next batch, limited by count and limit"""
+        if self.count:
+            batch_size = min(batch_size, self.count - self.iterations)
+        if limit:
+            batch_size = min(batch_size, limit)
+        return batch_size
+
+    def _done(self, count):
+        """account for `count' operations"""
+        self.iterations += count
+        if self.count and self.iterations >= self.count:
+            self.exhausted = True
+        return count
+
+
+class InsertOperation(Operation):
+    """insert or upsert documents"""
+
+    def __init__(self, plan, database, generator, throttle):
+        super().__init__(plan, database, generator, throttle)
+        self.batch_method = plan.batch_method
+        self.batch_size = plan.batch_size if plan.batch_method != "single" else 1
+        self.build_doc = generator.compile_doc(insert_template(plan.doc, self.operation))
+
+    def execute(self, limit=None):
+        """execute"""
+        count = self._batch(self.batch_size, limit)
+        build_doc = self.build_doc
+
+        if self.batch_method == "single":
+            doc = build_doc()
+            self.throttle.wait()
+            if self.operation == "insert":
+                self.collection.insert(doc)
+            else:
+                self.collection.update_one(
+                    {"_id": doc["_id"]},
+                    {"$set": doc},
+                    upsert=True)
+        elif self.batch_method == "array":
+            docs = [build_doc() for _ in range(count)]
+            self.throttle.wait(count)
+            self.collection.insert(docs)
+        else:
+            if self.batch_method == "unordered-bulk":
+                bulk = self.collection.initialize_unordered_bulk_op()
+            else:
+                bulk = self.collection.initialize_ordered_bulk_op()
+            for _ in range(count):
+                doc = build_doc()
+                if self.operation == "insert":
+                    bulk.insert(doc)
+                else:
+                    bulk.find({"_id": doc["_id"]}).upsert().update_one({"$set": doc})
+            self.throttle.wait(count)
+            bulk.execute()
+
+        return self._done(count)
+
+
+class FindOperation(Operation):
+    """find documents matching the `filter' template"""
+
+    def __init__(self, plan, database, generator, throttle):
+        super().__init__(plan, database, generator, throttle)
+        self.build_filter = generator.compile_doc(plan.filter)
+        self.limit = plan.limit
+
+    def execute(self, limit=None):
+        """execute"""
+        # pylint: disable=unused-argument
+        query = self.build_filter()
+        self.throttle.wait()
+        if self.limit == 1:
+            self.collection.find_one(query)
+        else:
+            for _ in self.collection.find(query, limit=self.limit):
+                pass
+        return self._done(1)
+
+
+class UpdateOperation(Operation):
+    """$set the `doc' template on one document matching the `filter' template"""
+
+    def __init__(self, plan, database, generator, throttle):
+        super().__init__(plan, database, generator, throttle)
+        self.build_filter = generator.compile_doc(plan.filter)
+        self.build_doc = generator.compile_doc(plan.doc)
+        self.upsert = plan.upsert
+
+    def execute(self, limit=None):
+        """execute"""
+        # pylint: disable=unused-argument
+        query = self.build_filter()
+        doc = self.build_doc()
+        self.throttle.wait()
+        self.collection.update_one(query, {"$set": doc}, upsert=self.upsert)
+        return self._done(1)
+
+
+class DeleteOperation(Operation):
+    """delete documents whose `field' is older than `retention-seconds'"""
+    periodic = True
+    counter = "deletes"
+
+    def __init__(self, plan, database, generator, throttle):
+        super().__init__(plan, database, generator, throttle)
+        self.field = plan.field
+        self.retention = timedelta(seconds=plan.retention_seconds)
+        self.interval = plan.interval_seconds
+
+    def execute(self, limit=None):
+        """execute"""
+        # pylint: disable=unused-argument
+        cutoff = datetime.now(tz=utc) - self.retention
+        result = self.collection.delete_many({self.field: {"$lt": cutoff}})
+        return self._done(result.deleted_count)
+
+
+class TtlMonitorOperation(Operation):
+    """report documents deleted by the server's TTL monitor
+
+    The count is server-wide, across every collection, and counts buckets rather than
+    measurements for time-series collections.
+    """
+    periodic = True
+    counter = "deletes"
+
+    def __init__(self, plan, database, generator, throttle):
+        super().__init__(plan, database, generator, throttle)
+        self.interval = plan.interval_seconds
+        self.deleted = None
+
+    def execute(self, limit=None):
+        """execute"""
+        # pylint: disable=unused-argument
+        status = self.database.command("serverStatus")
+        deleted = status["metrics"]["ttl"]["deletedDocuments"]
+        count = deleted - self.deleted if self.deleted is not None else 0
+        self.deleted = deleted
+        return count
+
+
+OPERATIONS = {
+    "insert": InsertOperation,
+    "upsert": InsertOperation,
+    "find": FindOperation,
+    "update": UpdateOperation,
+    "delete": DeleteOperation,
+    "ttl-monitor": TtlMonitorOperation,
+}
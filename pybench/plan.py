@@ -0,0 +1,335 @@
+"""
+Testcase plan
+
+The merged configuration is validated against a schema and compiled once into
+immutable plan objects, before any mongod is started.  Workers then read plain
+attributes instead of looking keys up in the configuration dictionaries.
+"""
+from .docgen import DocGenerator
+from .frozen import Immutable, freeze, thaw
+from .operations import OPERATIONS, insert_template
+from .remerge import remerge
+from .scheduler import Schedule
+
+
+REQUIRED = object()
+
+NUMBER = (int, float)
+
+BATCH_METHODS = ["unordered-bulk", "ordered-bulk", "array", "single"]
+
+DATABASE_SCHEMA = {
+    # key: (types, default, choices)
+    "name": (str, REQUIRED, None),
+    "disabled": (bool, False, None),
+    "clear-paths": (bool, False, None),
+    "options": (dict, {}, None),
+}
+
+TESTCASE_SCHEMA = {
+    "db-name": (str, "pybench", None),
+    "collection": (str, None, None),
+    "random-text-buffer-size": (int, 1000000, None),
+    "random-bytes-buffer-size": (int, 1000000, None),
+    "max-iterations": (int, REQUIRED, None),
+    "max-time-seconds": (NUMBER, REQUIRED, None),
+    "batch-size": (int, 1000, None),
+    "batch-method": (str, "array", BATCH_METHODS),
+    "rate-limit": (NUMBER, 0, None),
+    "threads-per-process": (int, 1, None),
+    "process-count": (int, 1, None),
+    "write-concern": (dict, {}, None),
+    "feedback-seconds": (NUMBER, 5, None),
+    "schedule": (dict, {}, None),
+    "startup": (dict, {}, None),
+    "testing": (dict, {}, None),
+    "cleanup": (dict, {}, None),
+}
+
+OPERATION_SCHEMA = {
+    "operation": (str, REQUIRED, sorted(OPERATIONS) + ["index", "create-collection"]),
+    "collection": (str, None, None),
+    "batch-size": (int, None, None),
+    "batch-method": (str, None, BATCH_METHODS),
+    "count": (int, None, None),
+    "weight": (NUMBER, 1, None),
+    "doc": (dict, {}, None),
+    "filter": (dict, {}, None),
+    "limit": (int, 1, None),
+    "upsert": (bool, False, None),
+    "indexes": (dict, {}, None),
+    "field": (str, None, None),
+    "retention-seconds": (NUMBER, None, None),
+    "interval-seconds": (NUMBER, 1, None),
+    "timeseries": (dict, None, None),
+    "expire-after-seconds": (int, None, None),
+    "drop": (bool, False, None),
+}
+
+SCHEDULE_SCHEMA = {
+    "mode": (str, "draw", ["draw", "assign"]),
+    "phases": (list, [{}], None),
+}
+
+PHASE_SCHEMA = {
+    "name": (str, None, None),
+    "duration-seconds": (NUMBER, None, None),
+    "weights": (dict, {}, None),
+    "rate-limit": (NUMBER, None, None),
+    "workers": (int, None, None),
+}
+
+
+class ConfigError(ValueError):
+    """Invalid configuration"""
+
+
+def validate(config, schema, path):
+    """check config against a schema, returns a dictionary with defaults filled in"""
+    if not isinstance(config, dict):
+        raise ConfigError("{}: expected an object".format(path))
+
+    for key in config:
+        if key not in schema:
+            raise ConfigError("{}: unknown setting `{}', expected one of: {}".format(
+                path, key, ", ".join(sorted(schema))))
+
+    result = {}
+    for key, (types, default, choices) in schema.items():
+        if key not in config or config[key] is None:
+            if default is REQUIRED:
+                raise ConfigError("{}: `{}' is required".format(path, key))
+            result[key] = default
+            continue
+        value = config[key]
+        if not isinstance(value, types) or (isinstance(value, bool) and types is not bool):
+            raise ConfigError("{}.{}: invalid value {!r}".format(path, key, value))
+        if choices is not None and value not in choices:
+            raise ConfigError("{}.{}: invalid value {!r}, expected one of: {}".format(
+                path, key, value, ", ".join(choices)))
+        result[key] = value
+    return result
+
+
+def check_positive(values, keys, path):
+    """check that the settings in keys are positive, if set"""
+    for key in keys:
+        if values[key] is not None and values[key] <= 0:
+            raise ConfigError("{}.{}: expected a positive value, not {!r}".format(
+                path, key, values[key]))
+
+
+def check_non_negative(values, keys, path):
+    """check that the settings in keys are not negative, if set"""
+    for key in keys:
+        if values[key] is not None and values[key] < 0:
+            raise ConfigError("{}.{}: expected a value of 0 or more, not {!r}".format(
+                path, key, values[key]))
+
+
+class Plan(Immutable):
+    """Immutable plan object"""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "{}({})".format(
+            type(self).__name__,
+            ", ".join("{}={!r}".format(key, getattr(self, key)) for key in self.__slots__))
+
+
+class DatabasePlan(Plan):
+    """Database plan"""
+    __slots__ = ("name", "enabled", "clear_paths", "options")
+
+
+class OperationPlan(Plan):
+    """Operation plan"""
+    __slots__ = ("name", "operation", "collection", "batch_method", "batch_size", "count",
+                 "weight", "doc", "filter", "limit", "upsert", "indexes", "field",
+                 "retention_seconds", "interval_seconds", "timeseries", "expire_after_seconds",
+                 "drop")
+
+
+class TestcasePlan(Plan):
+    """Testcase plan"""
+    __slots__ = ("name", "db_name", "max_iterations", "max_time_seconds", "rate_limit",
+                 "process_count", "threads_per_process", "worker_count",
+                 "random_text_buffer_size", "random_bytes_buffer_size",
+                 "startup", "testing", "cleanup", "schedule")
+
+
+class RunPlan(Plan):
+    """Plan for a complete run, config is the merged configuration"""
+    __slots__ = ("config", "databases", "testcase")
+
+
+def compile_database(database_config, defaults, path):
+    """compile a database plan"""
+    values = validate(
+        remerge([thaw(defaults), thaw(database_config)]),
+        DATABASE_SCHEMA,
+        path)
+    return DatabasePlan(
+        name=values["name"],
+        enabled=not values["disabled"],
+        clear_paths=values["clear-paths"],
+        options=freeze(values["options"]))
+
+
+def compile_operation(name, config, defaults, path):
+    """compile an operation plan, checking that its templates build documents"""
+    values = validate(config, OPERATION_SCHEMA, path)
+    for key in ["collection", "batch-size", "batch-method"]:
+        if values[key] is None:
+            values[key] = defaults[key]
+    check_positive(values, ["batch-size", "interval-seconds"], path)
+    check_non_negative(
+        values, ["count", "weight", "limit", "retention-seconds", "expire-after-seconds"], path)
+
+    operation = values["operation"]
+    if operation not in ["index", "ttl-monitor"] and values["collection"] is None:
+        raise ConfigError("{}: `collection' is required".format(path))
+    if values["batch-method"] == "array" and operation == "upsert":
+        raise ConfigError("{}: batch-method `array' is only valid for insert".format(path))
+    if operation == "delete":
+        for key in ["field", "retention-seconds"]:
+            if values[key] is None:
+                raise ConfigError("{}: `{}' is required for delete".format(path, key))
+
+    for item in values["indexes"].values():
+        if not isinstance(item, list) or \
+                not all(isinstance(index, dict) and "index" in index for index in item):
+            raise ConfigError("{}.indexes: expected lists of {{\"index\": ...}}".format(path))
+
+    # Build one document from each template, so that bad generator arguments are
+    # reported now rather than by a worker.  The buffers only need the configured sizes.
+    generator = DocGenerator(
+        "x" * defaults["random-text-buffer-size"],
+        bytes(defaults["random-bytes-buffer-size"]),
+        "a" * 10000)
+    for key, template in [("doc", insert_template(values["doc"], operation)),
+                          ("filter", values["filter"])]:
+        try:
+            generator.compile_doc(template)()
+        except Exception as error:  # pylint: disable=broad-except
+            raise ConfigError("{}.{}: invalid template ({!r})".format(path, key, error))
+
+    return OperationPlan(
+        name=name,
+        operation=operation,
+        collection=values["collection"],
+        batch_method=values["batch-method"],
+        batch_size=values["batch-size"],
+        count=values["count"],
+        weight=values["weight"],
+        doc=freeze(values["doc"]),
+        filter=freeze(values["filter"]),
+        limit=values["limit"],
+        upsert=values["upsert"],
+        indexes=freeze(values["indexes"]),
+        field=values["field"],
+        retention_seconds=values["retention-seconds"],
+        interval_seconds=values["interval-seconds"],
+        timeseries=freeze(values["timeseries"]),
+        expire_after_seconds=values["expire-after-seconds"],
+        drop=values["drop"])
+
+
+def is_scheduled(operation):
+    """True if the scheduler picks this operation, rather than it running periodically"""
+    return operation.operation in OPERATIONS and not OPERATIONS[operation.operation].periodic
+
+
+def compile_schedule(config, operations, rate_limit, path):
+    """validate the schedule and build it"""
+    values = validate(config, SCHEDULE_SCHEMA, path)
+    operations = [operation for operation in operations if is_scheduled(operation)]
+    names = [operation.name for operation in operations]
+
+    phases = []
+    for index, phase in enumerate(values["phases"]):
+        phase_path = "{}.phases[{}]".format(path, index)
+        phase = validate(phase, PHASE_SCHEMA, phase_path)
+        check_positive(phase, ["duration-seconds"], phase_path)
+        check_non_negative(phase, ["rate-limit", "workers"], phase_path)
+        for name, weight in phase["weights"].items():
+            if name not in names:
+                raise ConfigError("{}.weights: unknown operation `{}'".format(phase_path, name))
+            if not isinstance(weight, NUMBER) or isinstance(weight, bool) or weight < 0:
+                raise ConfigError("{}.weights.{}: invalid weight {!r}".format(
+                    phase_path, name, weight))
+        phases.append({key: value for key, value in phase.items() if value is not None})
+
+    return Schedule(
+        {"mode": values["mode"], "phases": phases},
+        {operation.name: operation.weight for operation in operations},
+        rate_limit=rate_limit)
+
+
+def compile_testcase(testcase_config, defaults, path):
+    """compile a testcase plan"""
+    if not isinstance(testcase_config, dict) or "name" not in testcase_config:
+        raise ConfigError("{}: `name' is required".format(path))
+    values = validate(
+        remerge([thaw(defaults), thaw(testcase_config.get("steps", {}))]),
+        TESTCASE_SCHEMA,
+        path)
+    check_positive(
+        values,
+        ["max-iterations", "max-time-seconds", "batch-size", "process-count",
+         "threads-per-process", "random-text-buffer-size", "random-bytes-buffer-size",
+         "feedback-seconds"],
+        path)
+    check_non_negative(values, ["rate-limit"], path)
+
+    sections = {}
+    for section in ["startup", "testing", "cleanup"]:
+        sections[section] = tuple(
+            compile_operation(name, config, values, "{}.{}.{}".format(path, section, name))
+            for name, config in values[section].items())
+
+    # Every worker runs the testing section, these would run once per worker
+    for item in sections["testing"]:
+        if item.operation in ["index", "create-collection"]:
+            raise ConfigError("{}.testing.{}: `{}' is only valid in startup or cleanup".format(
+                path, item.name, item.operation))
+
+    worker_count = values["process-count"] * values["threads-per-process"]
+    return TestcasePlan(
+        name=testcase_config["name"],
+        db_name=values["db-name"],
+        max_iterations=values["max-iterations"],
+        max_time_seconds=values["max-time-seconds"],
+        rate_limit=values["rate-limit"],
+        process_count=values["process-count"],
+        threads_per_process=values["threads-per-process"],
+        worker_count=worker_count,
+        random_text_buffer_size=values["random-text-buffer-size"],
+        random_bytes_buffer_size=values["random-bytes-buffer-size"],
+        startup=sections["startup"],
+        testing=sections["testing"],
+        cleanup=sections["cleanup"],
+        schedule=compile_schedule(
+            values["schedule"],
+            sections["testing"],
+            values["rate-limit"],
+            path + ".schedule"))
+
+
+def compile_plan(config):
+    """validate the merged configuration and compile it into a RunPlan"""
+    if "databases" not in config or not isinstance(config["databases"], list):
+        raise ConfigError("`databases' must be a list")
+    if "testcase" not in config:
+        raise ConfigError("`testcase' is required")
+
+    database_defaults = config.get("database-defaults", {})
+    return RunPlan(
+        config=freeze(config),
+        databases=tuple(
+            compile_database(database, database_defaults, "databases[{}]".format(index))
+            for index, database in enumerate(config["databases"])),
+        testcase=compile_testcase(
+            config["testcase"],
+            config.get("testcase-defaults", {}),
+            "testcase"))
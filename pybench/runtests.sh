@@ -4,3 +4,7 @@ pybench-mongodb examples/database.hjson examples/iibench.hjson examples/unordere
 pybench-mongodb examples/database.hjson examples/iibench.hjson examples/single.hjson
 pybench-mongodb examples/database.hjson examples/iibench.hjson examples/unordered-upsert.hjson
 pybench-mongodb examples/database.hjson examples/iibench.hjson examples/single-upsert.hjson
+pybench-mongodb examples/database.hjson examples/mixed.hjson
+pybench-mongodb examples/database.hjson examples/iibench-24hr.hjson examples/retention.hjson
+pybench-mongodb examples/database.hjson examples/iibench-24hr.hjson examples/ttl.hjson
+pybench-mongodb examples/database.hjson examples/timeseries.hjson
@@ -0,0 +1,169 @@
+"""
+Scheduler for mixed workloads
+
+A Schedule is a list of time-based phases, each with its own operation mix,
+rate limit and number of active workers.  Every worker thread owns a Scheduler
+which picks the next operation to run for the current phase.
+"""
+import bisect
+import random
+import time
+
+from .frozen import FrozenDict, Immutable
+
+
+IDLE_SLEEP = 0.1
+
+
+class Phase(Immutable):
+    """Phase"""
+    # pylint: disable=too-few-public-methods,too-many-arguments
+    __slots__ = ("name", "start", "end", "weights", "rate_limit", "workers")
+
+    def __init__(self, name, start, end, weights, rate_limit, workers):
+        super().__init__(
+            name=name,
+            start=start,
+            end=end,
+            weights=FrozenDict(weights),
+            rate_limit=rate_limit,
+            workers=workers)
+
+
+class Schedule(Immutable):
+    """Schedule
+
+    config is the "schedule" section of the testcase:
+        "mode": "draw" (each operation is drawn from the weighted mix) or
+                "assign" (each worker is assigned a single operation by weight)
+        "phases": [{"name", "duration-seconds", "weights", "rate-limit", "workers"}, ...]
+
+    weights maps operation names to their default weights.  A phase without a
+    duration lasts until the end of the run.  "workers" and "rate-limit" apply to
+    all workers of the run, across agents; a phase without "workers" uses them all.
+    """
+    __slots__ = ("mode", "phases", "duration")
+
+    def __init__(self, config, weights, rate_limit=0):
+        mode = config.get("mode", "draw")
+        assert mode in ["draw", "assign"]
+
+        phases = []
+        start = 0
+        for index, phase in enumerate(config.get("phases", [{}])):
+            duration = phase.get("duration-seconds")
+            end = start + duration if duration is not None else None
+            phase_weights = dict(weights)
+            phase_weights.update(phase.get("weights", {}))
+            phases.append(Phase(
+                phase.get("name", "phase {}".format(index + 1)),
+                start,
+                end,
+                phase_weights,
+                phase.get("rate-limit", rate_limit),
+                phase.get("workers")))
+            if end is None:
+                break
+            start = end
+
+        super().__init__(mode=mode, phases=tuple(phases), duration=phases[-1].end)
+
+    def is_phased(self):
+        """True if the schedule has been configured with phases"""
+        return len(self.phases) > 1 or self.phases[0].end is not None
+
+    def phase_at(self, elapsed):
+        """phase active `elapsed' seconds into the run"""
+        for phase in self.phases:
+            if phase.end is None or elapsed < phase.end:
+                return phase
+        return self.phases[-1]
+
+
+class Scheduler(object):
+    """Picks operations for a single worker
+
+    worker_id is the worker's position among all worker_count workers of the run,
+    across agents, so that phases activate and throttle workers globally.
+    """
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+
+    def __init__(self, schedule, operations, worker_id=0, throttle=None,
+                 start_time=None, threads_per_process=1, worker_count=1):
+        self.schedule = schedule
+        self.operations = operations
+        self.worker_id = worker_id
+        self.throttle = throttle
+        self.start_time = start_time if start_time else time.time()
+        self.threads_per_process = threads_per_process
+        self.worker_count = worker_count
+
+        self.phase = None
+        self.phase_end = 0
+        self.active = True
+        self.choices = []
+        self.cumulative = []
+        self.total = 0
+
+    def is_finished(self):
+        """True once every operation has run to its count"""
+        return all(operation.exhausted for operation in self.operations)
+
+    def next(self):
+        """next operation to run, or None if the worker is idle"""
+        if time.time() >= self.phase_end:
+            self._set_phase(self.schedule.phase_at(time.time() - self.start_time))
+
+        if not self.active or not self.choices:
+            time.sleep(IDLE_SLEEP)
+            return None
+
+        if len(self.choices) == 1:
+            operation = self.choices[0]
+        else:
+            operation = self.choices[
+                bisect.bisect_right(self.cumulative, random.random() * self.total)]
+
+        if operation.exhausted:
+            self._set_phase(self.phase)
+            return None
+        return operation
+
+    def _set_phase(self, phase):
+        """compute the operation table for a phase"""
+        self.phase = phase
+        self.phase_end = float("inf")
+        if phase.end is not None and self.start_time + phase.end > time.time():
+            self.phase_end = self.start_time + phase.end
+        workers = self.worker_count
+        if phase.workers is not None:
+            workers = min(phase.workers, workers)
+        self.active = self.worker_id < workers
+
+        choices = []
+        cumulative = []
+        total = 0
+        for operation in self.operations:
+            weight = phase.weights.get(operation.name, 0)
+            if weight > 0 and not operation.exhausted:
+                total += weight
+                choices.append(operation)
+                cumulative.append(total)
+
+        if self.schedule.mode == "assign" and choices and self.active:
+            # Spread the active workers across operations in proportion to weight
+            position = (self.worker_id + 0.5) / workers * total
+            choices = [choices[bisect.bisect_right(cumulative, position)]]
+            cumulative = [total]
+
+        self.choices = choices
+        self.cumulative = cumulative
+        self.total = total
+
+        if self.throttle:
+            # The throttle is shared by the threads of a process, give it the share of
+            # the phase rate of the process's active workers
+            first = self.worker_id - self.worker_id % self.threads_per_process
+            active = max(0, min(workers - first, self.threads_per_process))
+            share = active / workers if workers else 0
+            self.throttle.set_rate(phase.rate_limit * share)
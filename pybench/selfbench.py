@@ -0,0 +1,328 @@
+"""
+Self-benchmarks for pybench-mongodb
+
+Measures the load generator itself, without a server: document generation,
+stats logging, throttle accuracy and end-to-end Testcase.run throughput with
+driver calls going to an in-process stand-in that acknowledges every write.
+Runs are seeded and each benchmark reports the median of several repeats so
+that results can be tracked over time.
+"""
+import argparse
+from collections import defaultdict
+import json
+import os
+import platform
+import random
+import statistics
+import time
+
+from bson import BSON
+
+from pybench import __version__
+from .plan import compile_plan
+from .stats import Stats
+from .testcase import Testcase
+from .throttle import Throttle
+
+
+IIBENCH_DOC = {
+    "dateandtime": {"date": 0},
+    "cashregisterid": {"random-int": [0, 1000]},
+    "customerid": {"random-int": [0, 100000]},
+    "productid": {"random-int": [0, 10000]},
+    "price": {"random-float": 1000},
+    "cf1": {"iibench-string": {"length": 1000, "percent-compressible": 90}},
+}
+
+CONFIG = {
+    "databases": [],
+    "testcase-defaults": {
+        "collection": "MyData",
+        "max-iterations": 1000000000,
+        "max-time-seconds": 3,
+        "batch-size": 1000,
+        "batch-method": "array",
+        "process-count": 2,
+        "threads-per-process": 1,
+    },
+    "testcase": {
+        "name": "selfbench",
+        "steps": {
+            "testing": {
+                "insert data": {
+                    "operation": "insert",
+                    "doc": IIBENCH_DOC,
+                }
+            }
+        }
+    }
+}
+
+
+class FakeBulk(object):
+    """Bulk operation that encodes and acknowledges writes"""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.docs = []
+
+    def insert(self, doc):
+        """insert"""
+        self.docs.append(doc)
+
+    def find(self, query):
+        """find"""
+        # pylint: disable=unused-argument
+        return self
+
+    def upsert(self):
+        """upsert"""
+        return self
+
+    def update_one(self, update):
+        """update one"""
+        self.docs.append(update)
+
+    def execute(self):
+        """execute"""
+        self.collection.insert(self.docs)
+
+
+class FakeCollection(object):
+    """Collection stand-in, BSON-encodes every write as the driver would"""
+    # pylint: disable=no-self-use,unused-argument
+
+    def __init__(self):
+        self.count = 0
+
+    def insert(self, docs):
+        """insert"""
+        if isinstance(docs, dict):
+            docs = [docs]
+        for doc in docs:
+            BSON.encode(doc)
+        self.count += len(docs)
+
+    def update_one(self, query, update, upsert=False):
+        """update one"""
+        BSON.encode(update)
+        self.count += 1
+
+    def find_one(self, query):
+        """find one"""
+        BSON.encode(query)
+
+    def find(self, query, limit=0):
+        """find"""
+        BSON.encode(query)
+        return []
+
+    def delete_many(self, query):
+        """delete many"""
+        return argparse.Namespace(deleted_count=0)
+
+    def initialize_unordered_bulk_op(self):
+        """unordered bulk"""
+        return FakeBulk(self)
+
+    def initialize_ordered_bulk_op(self):
+        """ordered bulk"""
+        return FakeBulk(self)
+
+    def create_index(self, index, **kwargs):
+        """create index"""
+
+
+class FakeDatabase(defaultdict):
+    """Database stand-in"""
+
+    def __init__(self):
+        super().__init__(FakeCollection)
+
+    def command(self, command):
+        """command"""
+        # pylint: disable=no-self-use,unused-argument
+        return {"metrics": {"ttl": {"deletedDocuments": 0}}}
+
+
+class FakeTestcase(Testcase):
+    """Testcase whose workers talk to FakeDatabase"""
+
+    def connect(self):
+        """connect"""
+        return FakeDatabase()
+
+
+def measure(function, repeats):
+    """run function `repeats' times, it returns (count, seconds); returns the rates"""
+    rates = []
+    for repeat in range(repeats):
+        random.seed(repeat)
+        count, seconds = function()
+        rates.append(count / seconds)
+    return rates
+
+
+def timed(function, count):
+    """call function `count' times, returns (count, seconds)"""
+    start = time.perf_counter()
+    for _ in range(count):
+        function()
+    return count, time.perf_counter() - start
+
+
+def bench_docgen(testcase, count, repeats):
+    """compiled document generation"""
+    build = testcase.generator().compile_doc(IIBENCH_DOC)
+    return measure(lambda: timed(build, count), repeats)
+
+
+def bench_build_doc(testcase, count, repeats):
+    """build_doc, compiling the template on every call"""
+    return measure(lambda: timed(lambda: testcase.build_doc(IIBENCH_DOC, "insert"), count),
+                   repeats)
+
+
+def bench_resolve_value(testcase, count, repeats):
+    """resolve_value of a single generator"""
+    value = {"random-int": [0, 1000]}
+    return measure(lambda: timed(lambda: testcase.resolve_value(value), count), repeats)
+
+
+def bench_stats_log(count, repeats):
+    """Stats.log with the monitor consuming the queue"""
+    def run():
+        stats = Stats(count * 10, 3600)
+        with open(os.devnull, "w") as output:
+            stats.output = output
+            stats.start()
+            result = timed(lambda: stats.log("insert", {"ops": 1}), count)
+            stats.flush()
+        return result
+    return measure(run, repeats)
+
+
+def bench_process_item(count, repeats):
+    """Stats.process_item"""
+    def run():
+        stats = Stats(count * 10, 3600)
+        stats.start_time = time.time()
+        now = stats.start_time
+        return timed(lambda: stats.process_item(now, "insert", {"ops": 1}), count)
+    return measure(run, repeats)
+
+
+def bench_throttle_error(rate, seconds, repeats):
+    """achieved rate of Throttle.wait as a percentage of the requested rate"""
+    results = []
+    for _ in range(repeats):
+        throttle = Throttle()
+        throttle.set_rate(rate)
+        count, elapsed = timed(throttle.wait, int(rate * seconds))
+        results.append(100.0 * (count / elapsed) / rate)
+    return results
+
+
+def bench_throttle_overhead(count, repeats):
+    """Throttle.wait with no rate limit"""
+    throttle = Throttle()
+    return measure(lambda: timed(throttle.wait, count), repeats)
+
+
+def bench_run(seconds, repeats):
+    """end-to-end Testcase.run against FakeDatabase"""
+    config = json.loads(json.dumps(CONFIG))
+    config["testcase-defaults"]["max-time-seconds"] = seconds
+    plan = compile_plan(config)
+
+    def run():
+        testcase = FakeTestcase(plan.testcase)
+        stats = Stats(plan.testcase.max_iterations, plan.testcase.max_time_seconds)
+        with open(os.devnull, "w") as output:
+            stats.output = output
+            testcase.run("", stats)
+        return stats.total_inserts, stats.end_time - stats.start_time
+    return measure(run, repeats)
+
+
+def parse_args():
+    """parse the command line arguments"""
+    parser = argparse.ArgumentParser(description="Benchmark pybench-mongodb itself.")
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=5,
+        help="repeats of each benchmark, the median is reported")
+    parser.add_argument(
+        "--count",
+        type=int,
+        default=20000,
+        help="iterations of each micro benchmark")
+    parser.add_argument(
+        "--run-seconds",
+        type=float,
+        default=3,
+        help="duration of each end-to-end run")
+    parser.add_argument(
+        "--skip-run",
+        action="store_true",
+        help="only run the micro benchmarks")
+    parser.add_argument(
+        "--json",
+        metavar="FILE",
+        help="also write the results to FILE as JSON")
+    return parser.parse_args()
+
+
+def main():
+    """main"""
+    args = parse_args()
+
+    plan = compile_plan(CONFIG)
+    testcase = FakeTestcase(plan.testcase)
+    count = args.count
+    repeats = args.repeats
+
+    benchmarks = [
+        ("docgen.build", "docs/s", lambda: bench_docgen(testcase, count, repeats)),
+        ("testcase.build_doc", "docs/s", lambda: bench_build_doc(testcase, count, repeats)),
+        ("testcase.resolve_value", "calls/s",
+         lambda: bench_resolve_value(testcase, count, repeats)),
+        ("stats.log", "calls/s", lambda: bench_stats_log(count, repeats)),
+        ("stats.process_item", "calls/s", lambda: bench_process_item(count, repeats)),
+        ("throttle.wait", "calls/s", lambda: bench_throttle_overhead(count, repeats)),
+        ("throttle.wait-accuracy", "% of rate", lambda: bench_throttle_error(2000, 0.5, repeats)),
+    ]
+    if not args.skip_run:
+        benchmarks.append(
+            ("testcase.run", "docs/s", lambda: bench_run(args.run_seconds, min(repeats, 3))))
+
+    print("{:<24} {:>10} {:>14} {:>14} {:>14}".format(
+        "Benchmark", "Unit", "Median", "Min", "Max"))
+    results = []
+    for name, unit, function in benchmarks:
+        values = function()
+        result = {
+            "name": name,
+            "unit": unit,
+            "median": statistics.median(values),
+            "min": min(values),
+            "max": max(values),
+        }
+        results.append(result)
+        print("{:<24} {:>10} {:14.1f} {:14.1f} {:14.1f}".format(
+            name, unit, result["median"], result["min"], result["max"]))
+
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump({
+                "version": __version__,
+                "python": platform.python_version(),
+                "repeats": repeats,
+                "count": count,
+                "results": results,
+            }, output, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
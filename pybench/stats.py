@@ -32,11 +32,20 @@ class Stats(object):
     header_format = "Time,              Elapsed (s),      Int,     Int/s,     Total,   Total/s"
     data_format = "{},{:10d}{:10d},{:10.1f},{:10d},{:10.1f}"
 
-    def __init__(self, max_iterations, max_time_seconds):
+    def __init__(self, max_iterations, max_time_seconds, operations=None, schedule=None):
         self.max_iterations = max_iterations
         self.max_time_seconds = max_time_seconds
+        # Only break results down by operation for mixed workloads
+        self.operations = operations if operations and len(operations) > 1 else []
+        self.schedule = schedule if schedule and schedule.is_phased() else None
         self.interval = 5
         self.done = multiprocessing.Event()
+        # Checked by workers on every batch, much cheaper than done.is_set()
+        self.stopping = multiprocessing.RawValue("b", 0)
+        # Iterations not yet claimed by any worker
+        self.budget = multiprocessing.Value("q", max_iterations)
+        # Iterations claimed by workers and not yet settled, guarded by the budget's lock
+        self.claimed = multiprocessing.RawValue("q", 0)
         self.start_time = 0
         self.end_time = 0
         self.total_inserts = 0
@@ -44,6 +53,12 @@ class Stats(object):
         self.data = {}
         self.results = []
         self.lock = threading.Lock()
+        self.monitor = None
+        self.last_shown_index = 0
+        self.dump_delay = STATS_DUMP_DELAY
+        self.output = sys.stdout
+        # Called with (time_index, counters) as each interval is shown
+        self.on_interval = None
 
     def set_interval(self, interval):
         """set interval"""
@@ -63,17 +78,62 @@ class Stats(object):
 
         self.data[time_index][instance]["count"] += 1
 
-        if instance == "insert" and "inserts" in counters:
-            self.total_inserts += counters["inserts"]
+        if "ops" in counters:
+            self.total_inserts += counters["ops"]
             if self.total_inserts >= self.max_iterations:
-                self.done.set()
-
-        if time.time() - self.start_time > self.max_time_seconds:
-            self.done.set()
-
-    def log(self, instance, counters):
+                self.set_done()
+
+        if time.time() >= self.deadline():
+            self.set_done()
+
+    def set_done(self):
+        """tell every worker to stop"""
+        self.stopping.value = 1
+        self.done.set()
+
+    def deadline(self):
+        """time at which the run ends"""
+        duration = self.max_time_seconds
+        if self.schedule and self.schedule.duration:
+            duration = min(duration, self.schedule.duration)
+        return self.start_time + duration
+
+    def claim(self, count, settled=0):
+        """claim up to `count' iterations from the shared budget, returns the number granted
+
+        settled is the number of previously claimed iterations that have since been used.
+        """
+        with self.budget.get_lock():
+            granted = min(count, self.budget.value)
+            self.budget.value -= granted
+            self.claimed.value += granted - settled
+        return granted
+
+    def release(self, count, settled=0):
+        """return `count' unused iterations to the shared budget, settling them with the
+        `settled' claimed iterations that were used"""
+        if count or settled:
+            with self.budget.get_lock():
+                self.budget.value += count
+                self.claimed.value -= count + settled
+
+    def unsettled(self):
+        """number of claimed iterations that may still be released"""
+        with self.budget.get_lock():
+            return self.claimed.value
+
+    def header(self):
+        """header line, with the phase and per-operation rates if needed"""
+        header = Stats.header_format
+        if self.schedule:
+            header += ",{:>10}".format("Phase")
+        for operation in self.operations:
+            header += ",{:>10}".format(operation[:8] + "/s")
+        return header
+
+    def log(self, instance, counters, current_time=None):
         """log"""
-        self.queue.put([time.time(), instance, counters])
+        self.queue.put([current_time or time.time(), instance, counters])
 
     def start(self, interval=5):
         """start"""
@@ -81,8 +141,8 @@ class Stats(object):
         self.interval = interval
         self.lock.acquire()
         self.lock.release()
-        thread = threading.Thread(target=self.stats_monitor)
-        thread.start()
+        self.monitor = threading.Thread(target=self.stats_monitor)
+        self.monitor.start()
 
     def end(self):
         """end"""
@@ -91,20 +151,22 @@ class Stats(object):
 
     def save(self, file):
         """save"""
-        print(Stats.header_format, file=file)
+        print(self.header(), file=file)
 
         for item in self.results:
             self.show_result(item, file)
 
     def stats_monitor(self):
         """monitor"""
-        last_shown_index = 0
-
         logging.info("Starting stats monitor")
 
         output_count = 0
-        while not self.done.is_set():
-            time_index = (int(int(time.time() - self.interval - STATS_DUMP_DELAY) /
+        # Keep consuming until end(), so that workers never block on a full queue
+        while not self.end_time:
+            if not self.done.is_set() and time.time() >= self.deadline():
+                self.set_done()
+
+            time_index = (int(int(time.time() - self.interval - self.dump_delay) /
                               self.interval))
 
             self.lock.acquire()
@@ -114,15 +176,16 @@ class Stats(object):
             finally:
                 self.lock.release()
 
-            if time_index > last_shown_index:
+            if time_index > self.last_shown_index:
                 if output_count % 10 == 0:
-                    print(Stats.header_format)
+                    print(self.header(), file=self.output)
                 self.show_record(time_index)
+                self.publish(time_index)
                 output_count += 1
-                last_shown_index = time_index
+                self.last_shown_index = time_index
 
             if self.queue.full():
-                print("full")
+                print("full", file=self.output)
             try:
                 item = self.queue.get(True, 0.1)
             except queue.Empty:
@@ -130,14 +193,36 @@ class Stats(object):
 
             self.process_item(item[0], item[1], item[2])
 
-        if last_shown_index + 1 in self.data:
-            self.show_record(last_shown_index + 1)
-
         logging.info("Ending stats monitor")
 
-    def show_record(self, time_index, file=sys.stdout):
+    def flush(self):
+        """end the run, then process whatever is still queued and show the intervals not yet
+        shown, including the final partial interval"""
+        self.end()
+        if self.monitor:
+            self.monitor.join()
+        while True:
+            try:
+                item = self.queue.get(True, 0.05)
+            except queue.Empty:
+                break
+            self.process_item(item[0], item[1], item[2])
+
+        for time_index in sorted(self.data):
+            if time_index > self.last_shown_index:
+                self.show_record(time_index)
+                self.publish(time_index)
+                self.last_shown_index = time_index
+
+    def publish(self, time_index):
+        """pass an interval's counters to on_interval"""
+        if self.on_interval and self.data.get(time_index):
+            self.on_interval(time_index, self.data[time_index])
+
+    def show_record(self, time_index, file=None):
         """show record"""
         # pylint: disable=too-many-locals,too-many-branches
+        file = file or self.output
 
         if ((time_index+1) * self.interval) < self.start_time:
             return
@@ -147,17 +232,27 @@ class Stats(object):
             time.localtime((time_index+1) * self.interval))
 
         if len(self.data[time_index]) == 0:
-            print(Stats.data_format.format(
-                time_string, int(time.time() - self.start_time), 0, 0, 0, 0),
-                  file=file)
+            self.show_result({
+                "time-string": time_string,
+                "elapsed": int(time.time() - self.start_time),
+                "inserts": 0,
+                "insert-rate": 0,
+                "total": 0,
+                "total-rate": 0,
+                "operation-rates": [0 for _ in self.operations],
+                "phase": self.phase_name(time_index),
+            }, file)
         else:
             inserts = 0
             for instance in sorted(self.data[time_index]):
                 counters = self.data[time_index][instance]
-                inserts += counters.get("inserts")
+                inserts += counters.get("ops", 0)
 
-            # The first interval is truncated...
-            interval = min(self.interval, ((time_index+1) * self.interval) - self.start_time)
+            # The first and last intervals are truncated...
+            interval = (min((time_index+1) * self.interval, self.end_time or float("inf")) -
+                        max(time_index * self.interval, self.start_time))
+            if interval <= 0:
+                interval = self.interval
             result = {
                 "time-string": time_string,
                 "elapsed": int(time.time() - self.start_time),
@@ -165,17 +260,37 @@ class Stats(object):
                 "insert-rate": inserts / interval,
                 "total": self.total_inserts,
                 "total-rate": self.total_inserts / (time.time() - self.start_time),
+                "operation-rates": [
+                    self.operation_count(time_index, operation) / interval
+                    for operation in self.operations],
+                "phase": self.phase_name(time_index),
             }
             self.show_result(result, file)
             self.results.append(result)
 
+    def operation_count(self, time_index, operation):
+        """operations plus deletes logged by an operation during an interval"""
+        counters = self.data[time_index].get(operation, {})
+        return counters.get("ops", 0) + counters.get("deletes", 0)
+
+    def phase_name(self, time_index):
+        """name of the phase active in the middle of an interval"""
+        if not self.schedule:
+            return ""
+        return self.schedule.phase_at(
+            (time_index + 0.5) * self.interval - self.start_time).name
+
     def show_result(self, result, file):
         """show result"""
-        print(Stats.data_format.format(
+        line = Stats.data_format.format(
             result["time-string"],
             result["elapsed"],
             result["inserts"],
             result["insert-rate"],
             result["total"],
-            result["total-rate"]),
-              file=file)
+            result["total-rate"])
+        if self.schedule:
+            line += ",{:>10}".format(result["phase"][:10])
+        for rate in result["operation-rates"]:
+            line += ",{:10.1f}".format(rate)
+        print(line, file=file)
@@ -1,261 +1,289 @@
 """
 Testcase class
 """
-from collections import ChainMap
-from copy import deepcopy
-from datetime import datetime, timedelta
 import logging
 from multiprocessing import Process
 import random
 import threading
 import time
-import uuid
 
-from bson.binary import Binary
 import lorem
 import pymongo
-from pytz import utc
 
-from .remerge import remerge
+from .docgen import DocGenerator
+from .operations import OPERATIONS, insert_template
+from .scheduler import IDLE_SLEEP, Schedule, Scheduler
 from .throttle import Throttle
 
 
+SECTIONS = ("startup", "testing", "cleanup")
+
+# Seconds to wait for workers to finish their current batch once done
+DRAIN_TIMEOUT = 10
+
+# Smallest number of iterations a worker claims from the budget at a time
+MIN_CLAIM = 100
+
+
 class Testcase(object):
-    """Testcase"""
-    def __init__(self, testcase_config, config):
-        self.config = remerge([
-            deepcopy(config.get("testcase-defaults", {})),
-            deepcopy(testcase_config["steps"])
-        ])
-        self.name = testcase_config["name"]
+    """Testcase
+
+    When load is generated by several agents, agent_id and agent_count place
+    this host's workers among all of them.  Periodic operations then run on the
+    first agent only, as they act on, or report for, the whole server.
+    """
+    def __init__(self, plan, agent_id=0, agent_count=1):
+        self.plan = plan
+        self.name = plan.name
+        self.schedule = plan.schedule
+        self.agent_id = agent_id
+        self.agent_count = agent_count
         self.uri = ""
 
-        self.compressible = "".join("a" for _ in range(10000))
+        self.compressible = "a" * 10000
 
-        self.text = ""
-        while len(self.text) < self.config["random-text-buffer-size"]:
-            self.text += lorem.paragraph()
+        paragraphs = []
+        length = 0
+        while length < plan.random_text_buffer_size:
+            paragraphs.append(lorem.paragraph())
+            length += len(paragraphs[-1])
+        self.text = "".join(paragraphs)
 
-        self.bytes = bytes(
-            [random.randrange(0, 256) for _ in range(self.config["random-bytes-buffer-size"])])
+        self.bytes = random.getrandbits(8 * plan.random_bytes_buffer_size).to_bytes(
+            plan.random_bytes_buffer_size, "little")
 
-        self.throttles = {
-            "insert": Throttle()
-        }
-
-        # self.throttles["insert"].set_rate(18000, batch=1000, processes=self.config["process-count"])
+        self.throttle = Throttle()
 
     def get_name(self):
         """get name"""
         return self.name
 
+    def get_operation_names(self):
+        """names of the operations run while testing"""
+        return [item.name for item in self.plan.testing if item.operation in OPERATIONS]
+
     def connect(self):
         """connect"""
-        return pymongo.MongoClient(self.uri, tz_aware=True)[self.config.get("db-name", "pybench")]
+        return pymongo.MongoClient(self.uri, tz_aware=True)[self.plan.db_name]
 
-    def run(self, uri, stats):
+    def run(self, uri, stats, sections=SECTIONS):
         """run"""
         self.uri = uri
 
-        self._worker("startup")
+        if "startup" in sections:
+            self._worker("startup")
+        if "testing" in sections:
+            self._testing(stats)
+        if "cleanup" in sections:
+            self._worker("cleanup")
+
+    def _testing(self, stats):
+        """run the testing section in worker processes until done"""
         stats.start()
 
         process_list = []
-        for _ in range(self.config.get("process-count")):
+        for process_id in range(self.plan.process_count):
             process = Process(
                 target=self._process,
-                args=("testing", stats, ))
+                args=("testing", stats, process_id, ))
             process_list.append(process)
             process.start()
 
-        while not stats.done.is_set():
-            time.sleep(2)
+        # The periodic worker runs until done, so it is left out of the liveness check
+        periodic = None
+        if self.agent_id == 0 and any(
+                OPERATIONS[item.operation].periodic
+                for item in self.plan.testing if item.operation in OPERATIONS):
+            periodic = Process(target=self._periodic, args=(stats, ))
+            periodic.start()
 
-        stats.end()
+        # Workers may also finish on their own once their counts are exhausted
+        while not stats.done.wait(0.1):
+            if not any(process.is_alive() for process in process_list):
+                stats.set_done()
 
         logging.debug("Waiting on processes to finish.")
-        for process in process_list:
-            process.join(30)
+        deadline = time.time() + DRAIN_TIMEOUT
+        for process in process_list + ([periodic] if periodic else []):
+            process.join(max(0, deadline - time.time()))
             if process.is_alive():
                 process.terminate()
                 logging.info(
                     "One or more processes hasn't finished.  Manual cleanup may be required.")
 
-        self._worker("cleanup")
+        stats.flush()
 
-    def _process(self, section, stats):
+    def _process(self, section, stats, process_id):
         threads = []
-        for _ in range(self.config.get("threads-per-process")):
+        threads_per_process = self.plan.threads_per_process
+        for thread_id in range(threads_per_process):
+            worker_id = process_id * threads_per_process + thread_id
             thread = threading.Thread(
-                target=self._worker, args=(section, stats, ))
+                target=self._worker, args=(section, stats, worker_id, ))
             thread.start()
             threads.append(thread)
         for thread in threads:
             thread.join()
 
-    def _worker(self, section, stats=None):
-        """startup"""
+    def _worker(self, section, stats=None, worker_id=0):
+        """run the operations of a section"""
         database = self.connect()
-
-        for _, value in self.config.get(section, {}).items():
-            if value["operation"] in ["insert", "upsert"]:
-                max_iterations = value.get("count", None)
-                self.insert(
-                    value["operation"],
-                    database,
-                    ChainMap(value, self.config),
-                    stats,
-                    max_iterations=max_iterations)
-            elif value["operation"] == "index":
-                self.create_indexes(database, value)
-            else:
-                assert False
-
-    def _get_bulk(self, database, method, collection):
-        """get bulk"""
-        # pylint: disable=no-self-use
-        if method == "unordered-bulk":
-            bulk = database[collection].initialize_unordered_bulk_op()
-        elif method == "ordered-bulk":
-            bulk = database[collection].initialize_ordered_bulk_op()
+        # Position of the worker among the workers of every agent
+        worker_count = self.plan.worker_count
+        global_id = self.agent_id * worker_count + worker_id
+        global_count = self.agent_count * worker_count
+        if section == "testing":
+            generator = self.generator(global_id, global_count)
         else:
-            bulk = None
-        return bulk
-
-    def insert(self, operation, database, command, stats, max_iterations=None):
-        """insert"""
-        # pylint: disable=too-many-branches
-        iterations = 0
-
-        batch_method = command.get("batch-method")
-        batch_size = command.get("batch-size")
-
-        bulk = self._get_bulk(database, batch_method, command.get("collection"))
-
-        insert_array = []
-        last_check = 0
+            generator = self.generator()
+
+        operations = []
+        for item in getattr(self.plan, section):
+            if item.operation == "index":
+                self.create_indexes(database, item)
+            elif item.operation == "create-collection":
+                self.create_collection(database, item)
+            else:
+                operation = OPERATIONS[item.operation](item, database, generator, self.throttle)
+                if operation.periodic:
+                    # Run by _periodic while testing, otherwise just once
+                    if section != "testing":
+                        operation.execute()
+                elif section == "testing":
+                    operations.append(operation)
+                else:
+                    # Outside of testing, operations run one after another
+                    self._run(Scheduler(Schedule({}, {item.name: 1}), [operation]), stats)
+
+        if operations:
+            self._run(
+                Scheduler(
+                    self.schedule,
+                    operations,
+                    worker_id=global_id,
+                    throttle=self.throttle,
+                    start_time=stats.start_time if stats else None,
+                    threads_per_process=self.plan.threads_per_process,
+                    worker_count=global_count),
+                stats)
+
+    def _run(self, scheduler, stats):
+        """run operations picked by the scheduler until they are exhausted or the test is done
+
+        With stats, iterations are claimed from the shared budget in chunks so that the run
+        stops at exactly max-iterations.  Once the budget is empty, a worker waits for the
+        other workers' claims to be settled, as they may release unused iterations.
+        """
+        # pylint: disable=no-self-use,too-many-branches
+        if stats is None:
+            while not scheduler.is_finished():
+                operation = scheduler.next()
+                if operation is not None:
+                    operation.execute()
+            return
+
+        pending = {}
         last_log = 0
-        logged_inserts = 0
-
-        while True:
-            doc = self.build_doc(command.get("doc"), operation)
-            iterations += 1
-
-            # Only check every 5 seconds
-            if time.time() - last_check > 5:
-                last_check = time.time()
-                if stats and stats.done.is_set():
-                    break
+        allowance = 0
+        # Iterations granted by the last claim
+        held = 0
+        chunk = max([MIN_CLAIM] + [operation.batch_size for operation in scheduler.operations])
+        deadline = stats.deadline()
+        stopping = stats.stopping
+
+        try:
+            while not scheduler.is_finished():
+                operation = scheduler.next()
+                if operation is None:
+                    # Don't hold on to iterations while idle
+                    if allowance:
+                        stats.release(allowance, held - allowance)
+                        allowance = held = 0
+                elif allowance == 0:
+                    allowance = held = stats.claim(chunk, held)
+                    if allowance == 0:
+                        if not stats.unsettled():
+                            break
+                        operation = None
+                        time.sleep(IDLE_SLEEP)
+
+                if operation is not None:
+                    count = operation.execute(allowance)
+                    allowance -= count
+                    pending[operation] = pending.get(operation, 0) + count
 
-            if bulk:
-                if operation == "insert":
-                    bulk.insert(doc)
-                elif operation == "upsert":
-                    bulk.find({"_id": doc["_id"]}).upsert().update_one({"$set": doc})
-                else:
-                    assert False
-                if iterations % batch_size == 0:
-                    self.throttles["insert"].wait()
-                    bulk.execute()
-                    if stats:
-                        stats.log("insert", {"inserts": batch_size})
-                    bulk = self._get_bulk(database, batch_method, command.get("collection"))
-            elif batch_method == "array":
-                assert operation == "insert"
-                insert_array.append(doc)
-                if iterations % batch_size == 0:
-                    self.throttles["insert"].wait()
-                    database[command.get("collection")].insert(insert_array)
-                    if stats:
-                        stats.log("insert", {"inserts": batch_size})
-                    insert_array = []
-            elif batch_method == "single":
-                self.throttles["insert"].wait()
-                if operation == "insert":
-                    database[command.get("collection")].insert(doc)
-                elif operation == "upsert":
-                    database[command.get("collection")].update_one(
-                        {"_id": doc["_id"]},
-                        {"$set": doc},
-                        upsert=True)
-                else:
-                    assert False
-                logged_inserts += 1
                 current_time = time.time()
-                if stats and current_time - last_log > 0.2:
-                    stats.log("insert", {"inserts": logged_inserts})
-                    logged_inserts = 0
+                if current_time - last_log > 0.2:
+                    for operation, count in pending.items():
+                        stats.log(operation.name, {operation.counter: count})
+                    pending = {}
                     last_log = current_time
-            else:
-                assert False
 
-            if max_iterations and iterations > max_iterations:
-                break
+                if stopping.value or current_time >= deadline:
+                    break
+        finally:
+            # Also if an operation raised, so that other workers don't wait on this claim
+            stats.release(allowance, held - allowance)
+            for operation, count in pending.items():
+                stats.log(operation.name, {operation.counter: count})
+
+    def _periodic(self, stats):
+        """run the periodic testing operations, such as windowed deletes, until done"""
+        database = self.connect()
+        generator = self.generator()
+        operations = [
+            OPERATIONS[item.operation](item, database, generator, self.throttle)
+            for item in self.plan.testing
+            if item.operation in OPERATIONS and OPERATIONS[item.operation].periodic]
+        next_times = [0 for _ in operations]
+
+        while not stats.done.is_set():
+            for index, operation in enumerate(operations):
+                if time.time() >= next_times[index]:
+                    count = operation.execute()
+                    if count:
+                        stats.log(operation.name, {operation.counter: count})
+                    next_times[index] = time.time() + operation.interval
+            stats.done.wait(max(0, min(next_times) - time.time()))
+
+    def generator(self, worker_id=0, worker_count=1):
+        """get a document generator for a worker"""
+        return DocGenerator(self.text, self.bytes, self.compressible, worker_id, worker_count)
+
+    def compile_doc(self, input_doc, operation, worker_id=0, worker_count=1):
+        """compile a document template, returns a callable building a new document"""
+        return self.generator(worker_id, worker_count).compile_doc(
+            insert_template(input_doc, operation))
 
     def build_doc(self, input_doc, operation):
         """build doc"""
-        doc = {}
-        for key, value in input_doc.items():
-            doc[key] = self.resolve_value(value)
-        if operation == "upsert":
-            doc["_id"] = uuid.uuid4()
-        return doc
+        return self.compile_doc(input_doc, operation)()
 
     def resolve_value(self, value):
         """resolve value"""
-        # pylint: disable=too-many-return-statements,too-many-branches
-
-        if isinstance(value, str):
-            return value
-        elif isinstance(value, int):
-            return value
-        elif isinstance(value, float):
-            return value
-        elif isinstance(value, dict):
-            assert len(value) == 1
-            key, value = list(value.items())[0]
-
-            if key == "random-int":
-                return random.randint(value[0], value[1])
-            elif key == "random-float":
-                return random.random() * value
-            elif key == "random-list":
-                return value[random.randrange(0, len(value))]
-            elif key == "iibench-string":
-                compress_count = int((value["percent-compressible"] / 100) * value["length"])
-                noncompress_count = value["length"] - compress_count
-                start = random.randrange(0, len(self.text)-noncompress_count)
-                end = start+noncompress_count
-                return self.text[start:end] + self.compressible[0:compress_count]
-            elif key == "random-text":
-                length = self.resolve_value(value)
-                start = random.randrange(0, len(self.text)-length)
-                end = start+length
-                return self.text[start:end]
-            elif key == "random-bytes":
-                length = self.resolve_value(value)
-                start = random.randrange(0, len(self.bytes)-length)
-                end = start+length
-                return Binary(self.bytes[start:end], 3)
-            elif key == "date":
-                offset = self.resolve_value(value)
-                return datetime.now(tz=utc) + timedelta(seconds=offset)
-            elif key == "uuid":
-                assert value is None
-                return uuid.uuid4()
-            elif key == "uuid-string":
-                assert value is None
-                return str(uuid.uuid4())
-            else:
-                assert False
+        return self.generator().compile_value(value)()
+
+    def create_collection(self, database, command):
+        """create a collection, optionally time-series and/or expiring"""
+        # pylint: disable=no-self-use
+        kwargs = {}
+        if command.timeseries:
+            kwargs["timeseries"] = dict(command.timeseries)
+        if command.expire_after_seconds is not None:
+            kwargs["expireAfterSeconds"] = command.expire_after_seconds
+
+        if command.drop:
+            database.drop_collection(command.collection)
+        logging.debug("Creating collection %s %s.", command.collection, kwargs)
+        database.create_collection(command.collection, **kwargs)
 
     def create_indexes(self, database, command):
         """create indexes"""
         # pylint: disable=no-self-use
 
-        for collection in command["indexes"]:
+        for collection in command.indexes:
             logging.debug("Creating indexes for %s.", collection)
-            for item in command["indexes"][collection]:
+            for item in command.indexes[collection]:
                 index = [(x[0], x[1]) for x in item["index"]]
                 logging.debug("Creating %s.", index)
                 if "kwargs" in item:
@@ -6,11 +6,16 @@ import time
 import threading
 
 
+# Seconds the throttle may fall behind schedule and still catch up, beyond that
+# the lost time is forgotten instead of being made up with a burst
+MAX_LAG = 0.05
+
+
 class Throttle:
     """Throttle"""
     def __init__(self):
         self.lock = threading.Lock()
-        self.last_time = 0
+        self.next_time = 0
         self.interval = 0
 
     def set_interval(self, interval):
@@ -24,16 +29,21 @@ class Throttle:
         else:
             self.interval = 0
 
-    def wait(self):
-        """wait"""
+    def wait(self, count=1):
+        """wait until `count' operations may proceed"""
         if self.interval == 0:
             return
 
         self.lock.acquire()
         try:
-            sleep_time = self.interval - (time.time() - self.last_time)
+            now = time.time()
+            sleep_time = self.next_time - now
             if sleep_time > 0:
                 time.sleep(sleep_time)
-            self.last_time = time.time()
+            elif -sleep_time > max(self.interval, MAX_LAG):
+                self.next_time = now
+            # Advance from the schedule rather than from now, so that oversleeping
+            # doesn't lower the achieved rate
+            self.next_time += self.interval * count
         finally:
             self.lock.release()
@@ -40,6 +40,7 @@ setup(
     entry_points={
         'console_scripts': [
             'pybench-mongodb=pybench.main:main',
+            'pybench-selfbench=pybench.selfbench:main',
         ],
     },
     classifiers=[